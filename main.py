@@ -1,45 +1,251 @@
-import json
+from __future__ import annotations
+
 import os
+import atexit
+import gzip
+import html
 import logging
-import requests
+import logging.handlers
+import queue
+import orjson
 import sys
-import argparse
+import random
+import time
+
+from types import MappingProxyType
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
 
+# requests и его зависимости импортируются при первом сетевом вызове, чтобы не замедлять запуск (например, --help)
+if TYPE_CHECKING:
+    import requests
+    from urllib3.util.retry import Retry
+
 load_dotenv(override=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    filename="app.log",
-    filemode="w",
-    encoding="utf-8"
-)
+# Запись в файл выполняется в фоновом потоке, основной поток только ставит записи в очередь
+_log_queue = queue.Queue(-1)
+_file_handler = logging.FileHandler("app.log", mode="w", encoding="utf-8")
+_file_handler.setFormatter(logging.Formatter(
+    fmt="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+))
+_log_listener = logging.handlers.QueueListener(_log_queue, _file_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.root.addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.root.setLevel(logging.INFO)
+
+LOGIN = os.getenv("LOGIN")
+PASSWORD = os.getenv("PASSWORD")
+BASE_URL = (os.getenv("BASE_URL") or "").rstrip("/")
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_CHAT_ID = os.getenv("BOT_CHAT_ID")
+BOT_THREAD_ID = os.getenv("BOT_THREAD_ID")
+TELEGRAM_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+TELEGRAM_ENABLED = True
+
+ERR_TEMPLATE = "❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{}</i>"
+OK_TEMPLATE = "✅ Подтверждение отправлено\n📎<b>Файл:</b><i>{}</i>"
+
+# Неизменяемая часть параметров обработки файла
+_PROC_DATA_TEMPLATE = MappingProxyType({
+    "cancel_reason": "",
+    "dataType": "json"
+})
+
+REQUEST_TIMEOUT = 30
+UPLOAD_BUFFER_LIMIT = 16 * 1024 * 1024
+TG_TIMEOUT = 5
+TG_MESSAGE_LIMIT = 4096
+TG_RETRIES = 3
+TG_BACKOFF_BASE = 1.0
+TG_BACKOFF_JITTER = 1.0
+TG_BACKOFF_MAX = 30.0
+
+_tg_session = None
+_tg_buffer: list[str] = []
+
+
+
+def _set_base_url(base_url: str) -> None:
+    """
+    Задаёт базовый URL сайта и пересчитывает адреса методов.
+    Args:
+        base_url: str
+    """
+    global BASE_URL, AUTH_URL, UPLOAD_URL, PROC_URL
+    BASE_URL = base_url.rstrip("/")
+    AUTH_URL = f"{BASE_URL}/auth-ajax_login"
+    UPLOAD_URL = f"{BASE_URL}/supplier_answer-load_answer_file"
+    PROC_URL = f"{BASE_URL}/supplier_answer-proc_answer_file"
+
+
+_set_base_url(BASE_URL)
+
+
+
+def _get_tg_session() -> requests.Session:
+    """
+    Возвращает общую сессию для Telegram, создавая её при первом обращении.
+    Returns:
+        requests.Session: Сессия для запросов к Telegram API
+    """
+    global _tg_session
+    if _tg_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Повторы для Telegram выполняет _send_tg, адаптер отвечает только за пул соединений
+        _tg_session = requests.Session()
+        _tg_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return _tg_session
+
+
+
+def send_telegram_message(text: str, flush: bool = False):
+    """
+    Ставит сообщение в очередь для Telegram-группы.
+    Накопленные сообщения отправляются при flush=True или при завершении работы,
+    по одному запросу на каждый блок до TG_MESSAGE_LIMIT символов.
+    Args:
+        text: str
+        flush: bool
+    """
+    if not TELEGRAM_ENABLED:
+        return
+    _tg_buffer.append(text)
+    if flush:
+        _flush_tg()
+
+
+
+def _flush_tg() -> None:
+    """
+    Отправляет накопленные сообщения в Telegram-группу.
+    Сообщения объединяются в блоки не длиннее TG_MESSAGE_LIMIT символов.
+    Сообщение длиннее лимита не разрезается (это сломало бы HTML-разметку), а пропускается.
+    """
+    chunks: list[str] = []
+    for message in _tg_buffer:
+        if len(message) > TG_MESSAGE_LIMIT:
+            logging.error("Сообщение для Telegram длиннее %s символов пропущено.", TG_MESSAGE_LIMIT)
+        elif chunks and len(chunks[-1]) + 2 + len(message) <= TG_MESSAGE_LIMIT:
+            chunks[-1] += "\n\n" + message
+        else:
+            chunks.append(message)
+    _tg_buffer.clear()
+    for chunk in chunks:
+        _send_tg(chunk)
 
 
 
-def send_telegram_message(text: str):
+def _send_tg(text: str) -> None:
     """
-    Отправляет сообщение в Telegram-группу с помощью бота.
+    Отправляет одно сообщение в Telegram-группу, повторяя попытку при временных сбоях.
+    Args:
+        text: str
     """
-    token = os.getenv("BOT_TOKEN")
-    chat_id = os.getenv("BOT_CHAT_ID")
-    thread_id = os.getenv("BOT_THREAD_ID")
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
     data = {
-        "chat_id": chat_id,
+        "chat_id": BOT_CHAT_ID,
         "text": text,
         "parse_mode": "HTML"
     }
-    if thread_id:
-        data["message_thread_id"] = thread_id
+    if BOT_THREAD_ID:
+        data["message_thread_id"] = BOT_THREAD_ID
+    import requests
+
+    # Повторяются только временные сбои: ошибки соединения, таймауты, 429 и 5xx
+    for attempt in range(TG_RETRIES + 1):
+        # Экспоненциальная задержка со случайным разбросом
+        delay = TG_BACKOFF_BASE * 2 ** attempt + random.uniform(0, TG_BACKOFF_JITTER)
+        try:
+            resp = _get_tg_session().post(TELEGRAM_URL, data=data, timeout=TG_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logging.error("Ошибка отправки сообщения в Telegram: %s", e)
+        except Exception as e:
+            logging.error("Ошибка отправки сообщения в Telegram: %s", e)
+            return
+        else:
+            if resp.ok:
+                logging.info("Сообщение отправлено в Telegram.")
+                return
+            logging.error("Ошибка отправки сообщения в Telegram: HTTP %s: %s", resp.status_code, resp.text[:200])
+            if resp.status_code == 429:
+                delay = _tg_retry_after(resp, delay)
+            elif resp.status_code < 500:
+                return
+        if attempt == TG_RETRIES:
+            return
+        time.sleep(min(delay, TG_BACKOFF_MAX))
+
+
+
+def _tg_retry_after(response: requests.Response, default: float) -> float:
+    """
+    Возвращает задержку из поля parameters.retry_after ответа Telegram на 429.
+    Args:
+        response: requests.Response
+        default: float
+    Returns:
+        float: Задержка в секундах или default, если поле отсутствует
+    """
     try:
-        resp = requests.post(url, data=data)
-        resp.raise_for_status()
-        logging.info("Сообщение отправлено в Telegram.")
-    except Exception as e:
-        logging.error(f"Ошибка отправки сообщения в Telegram: {e}")
+        return float(orjson.loads(response.content)["parameters"]["retry_after"])
+    except Exception:
+        return default
+
+
+atexit.register(_flush_tg)
+
+
+
+def _format_tg(template: str, value: object) -> str:
+    """
+    Подставляет значение в шаблон сообщения Telegram.
+    Значение экранируется для parse_mode=HTML и обрезается так, чтобы сообщение не превышало TG_MESSAGE_LIMIT.
+    Args:
+        template: str
+        value: object
+    Returns:
+        str: Готовый текст сообщения
+    """
+    limit = TG_MESSAGE_LIMIT - len(template)
+    text = html.escape(str(value)[:limit])
+    if len(text) > limit:
+        # Экранирование удлиняет текст не более чем в 6 раз ("&quot;")
+        text = html.escape(str(value)[:limit // 6])
+    return template.format(text)
+
+
+
+def _notify_err(error: object, flush: bool = False) -> None:
+    """
+    Отправляет в Telegram сообщение об ошибке подтверждения.
+    Args:
+        error: object - исключение или текст ошибки
+        flush: bool - отправить накопленные сообщения сразу
+    """
+    send_telegram_message(_format_tg(ERR_TEMPLATE, error), flush=flush)
+
+
+
+def _response_ok(response: requests.Response, flush: bool = False) -> bool:
+    """
+    Проверяет HTTP-статус ответа до разбора тела.
+    Args:
+        response: requests.Response
+        flush: bool
+    Returns:
+        bool: True если статус успешный, False в противном случае
+    """
+    if response.ok:
+        return True
+    snippet = response.text[:200]
+    logging.error("HTTP %s: %s", response.status_code, snippet)
+    _notify_err(f"HTTP {response.status_code}: {snippet}", flush=flush)
+    return False
 
 
 
@@ -52,17 +258,37 @@ def get_config(json_file: str="config.json") -> dict | None:
         dict | None: Конфигурация или None в случае ошибки
     """
     try:
-        with open(json_file, "r") as f:
-            config = json.load(f)
+        with open(json_file, "rb") as f:
+            config = orjson.loads(f.read())
         logging.info("Конфиг успешно загружен.")
         return config
     except Exception as e:
-        logging.error(f"Ошибка загрузки конфига: {e}")
-        send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{e}</i>")
+        logging.error("Ошибка загрузки конфига: %s", e)
+        _notify_err(e)
         return None
 
 
 
+def _site_retry(allowed_methods: list[str]) -> Retry:
+    """
+    Создаёт политику повторов для запросов к сайту.
+    Args:
+        allowed_methods: list[str]
+    Returns:
+        Retry: Повторы при 429/5xx и ошибках соединения с экспоненциальной задержкой
+    """
+    from urllib3.util.retry import Retry
+
+    return Retry(
+        total=3,
+        backoff_factor=1.0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=allowed_methods,
+        respect_retry_after_header=True
+    )
+
+
+
 def init_session(config: dict) -> requests.Session | None:
     """
     Инициализирует сессию для работы с сайтом.
@@ -72,13 +298,21 @@ def init_session(config: dict) -> requests.Session | None:
         requests.Session | None: Сессия или None в случае ошибки
     """
     try:
+        import requests
+        from requests.adapters import HTTPAdapter
+
         session = requests.Session()
-        session.get(os.getenv("BASE_URL"))
+        # POST повторяется только для авторизации и загрузки файла из памяти;
+        # обработка файла и потоковая загрузка идут через _single_post_session
+        adapter = HTTPAdapter(max_retries=_site_retry(["GET", "POST"]), pool_connections=4, pool_maxsize=10, pool_block=False)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip"})
+        session.get(BASE_URL, timeout=REQUEST_TIMEOUT)
         logging.info("Сессия инициализирована.")
         return session
     except Exception as e:
-        logging.error(f"Ошибка инициализации сессии: {e}")
-        send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{e}</i>")
+        logging.error("Ошибка инициализации сессии: %s", e)
+        _notify_err(e)
         return None
 
 
@@ -93,25 +327,102 @@ def authorize(session: requests.Session) -> bool:
     """
     try:
         payload = {
-            "login": os.getenv("LOGIN"),
-            "password": os.getenv("PASSWORD"),
+            "login": LOGIN,
+            "password": PASSWORD,
             "save_password": "on",
         }
-        response = session.post(os.path.join(os.getenv("BASE_URL"), "auth-ajax_login"), data=payload)
-        response.raise_for_status()
+        response = session.post(AUTH_URL, data=payload, timeout=REQUEST_TIMEOUT)
+        if not _response_ok(response):
+            return False
         logging.info("Авторизация прошла успешно.")
-        if response.json().get("errors"):
-            logging.error(f"Ошибка авторизации: {response.json()['errors']}")
-            send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{response.json()['errors']}</i>")
+        errors = orjson.loads(response.content).get("errors")
+        if errors:
+            logging.error("Ошибка авторизации: %s", errors)
+            _notify_err(errors)
             return False
         return True
     except Exception as e:
-        logging.error(f"Ошибка авторизации: {e}")
-        send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{e}</i>")
+        logging.error("Ошибка авторизации: %s", e)
+        _notify_err(e)
         return False
 
 
 
+def _post_gzip(session: requests.Session, url: str, files: dict) -> requests.Response:
+    """
+    Отправляет multipart-запрос, сжатый gzip (Content-Encoding: gzip).
+    Если сервер не принимает сжатое тело (415), запрос повторяется без сжатия.
+    Args:
+        session: requests.Session
+        url: str
+        files: dict
+    Returns:
+        requests.Response: Ответ сервера
+    """
+    from urllib3 import encode_multipart_formdata
+
+    body, content_type = encode_multipart_formdata(files)
+    response = session.post(
+        url,
+        data=gzip.compress(body, compresslevel=1),
+        headers={"Content-Type": content_type, "Content-Encoding": "gzip"},
+        timeout=REQUEST_TIMEOUT
+    )
+    if response.status_code == 415:
+        logging.warning("Сервер не принимает сжатые запросы, файл отправляется без сжатия.")
+        response = session.post(url, data=body, headers={"Content-Type": content_type}, timeout=REQUEST_TIMEOUT)
+    return response
+
+
+
+def _single_post_session(session: requests.Session) -> requests.Session:
+    """
+    Создаёт сессию для POST-запросов, которые нельзя отправлять повторно.
+    Адаптер повторяет только ошибки установки соединения, но не POST после отправки тела.
+    Args:
+        session: requests.Session - основная сессия, чьи заголовки и cookies авторизации используются
+    Returns:
+        requests.Session: Новая сессия, которую нужно закрыть после запроса
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    single_session = requests.Session()
+    single_session.headers = session.headers
+    single_session.cookies = session.cookies
+    single_session.mount("https://", HTTPAdapter(max_retries=_site_retry(["GET"])))
+    return single_session
+
+
+
+def _post_stream(session: requests.Session, url: str, file_name: str, f) -> requests.Response:
+    """
+    Отправляет файл потоком через MultipartEncoder.
+    Поток нельзя перемотать для повтора, поэтому запрос идёт через отдельный адаптер,
+    который не повторяет POST (повторяются только ошибки установки соединения).
+    Args:
+        session: requests.Session
+        url: str
+        file_name: str
+        f: файловый объект, открытый в режиме "rb"
+    Returns:
+        requests.Response: Ответ сервера
+    """
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+    encoder = MultipartEncoder(fields={
+        "order_answer_file": (file_name, f, "application/vnd.ms-excel")
+    })
+    with _single_post_session(session) as stream_session:
+        return stream_session.post(
+            url,
+            data=encoder,
+            headers={"Content-Type": encoder.content_type},
+            timeout=REQUEST_TIMEOUT
+        )
+
+
+
 def upload_file(session: requests.Session, config: dict, file_path: str) -> str | None:
     """
     Загружает файл подтверждения заказа на сайт.
@@ -122,20 +433,30 @@ def upload_file(session: requests.Session, config: dict, file_path: str) -> str
     Returns:
         str | None: Имя загруженного файла или None в случае ошибки
     """
-    url = os.path.join(os.getenv("BASE_URL"), "supplier_answer-load_answer_file")
     try:
+        fname = os.path.basename(file_path)
         with open(file_path, "rb") as f:
-            files = {
-                "order_answer_file": (file_path, f, "application/vnd.ms-excel")
-            }
-            upload_response = session.post(url, files=files)
-            upload_response.raise_for_status()
+            if os.fstat(f.fileno()).st_size < UPLOAD_BUFFER_LIMIT:
+                # Небольшой файл читается за один вызов и отправляется единым телом запроса,
+                # которое адаптер сессии может отправить повторно
+                files = {
+                    "order_answer_file": (fname, f.read(), "application/vnd.ms-excel")
+                }
+                if config.get("gzip_upload"):
+                    upload_response = _post_gzip(session, UPLOAD_URL, files)
+                else:
+                    upload_response = session.post(UPLOAD_URL, files=files, timeout=REQUEST_TIMEOUT)
+            else:
+                # Большой файл отправляется потоком, без буферизации всего тела запроса в памяти
+                upload_response = _post_stream(session, UPLOAD_URL, fname, f)
+        if not _response_ok(upload_response):
+            return None
         logging.info("Файл подтверждения успешно загружен.")
-        upload_data = upload_response.json()
+        upload_data = orjson.loads(upload_response.content)
         return upload_data["data"]["file_name"]
     except Exception as e:
-        logging.error(f"Ошибка загрузки файла: {e}")
-        send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{e}</i>")
+        logging.error("Ошибка загрузки файла: %s", e)
+        _notify_err(e)
         return None
 
 
@@ -149,39 +470,44 @@ def process_file(session: requests.Session, file_name: str, file_path: str, conf
         file_path: str
         config: dict
     """
-    proc_url = os.path.join(os.getenv("BASE_URL"), "supplier_answer-proc_answer_file")
     proc_data = {
+        **_PROC_DATA_TEMPLATE,
         "order_id_col": config["order_id_col"],  # номер колонки для "№ заказа клиента"
         "quantity_col": config["quantity_col"],  # номер колонки для "Количество"
         "order_product_id_col": config["order_product_id_col"],  # номер колонки для "Код позиции"
-        "file_name": file_name,
-        "cancel_reason": "",
-        "dataType": "json"
+        "file_name": file_name
     }
     try:
-        proc_response = session.post(proc_url, data=proc_data)
-        proc_response.raise_for_status()
+        # Обработка файла не идемпотентна: повторный POST запустил бы её ещё раз
+        with _single_post_session(session) as proc_session:
+            proc_response = proc_session.post(PROC_URL, data=proc_data, timeout=REQUEST_TIMEOUT)
+        if not _response_ok(proc_response, flush=True):
+            return
         try:
-            resp_obj = proc_response.json()
-            pretty = json.dumps(resp_obj, ensure_ascii=False, indent=2)
-            logging.info(f"Ответ сервера:\n{pretty}")
+            resp_obj = orjson.loads(proc_response.content)
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                pretty = orjson.dumps(resp_obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+                logging.info("Ответ сервера:\n%s", pretty)
             # Проверяем успешность по статусу
             if str(resp_obj.get("status_code")) == "0":
                 fname = os.path.basename(file_path)
-                send_telegram_message(f"✅ Подтверждение отправлено\n📎<b>Файл:</b><i>{fname}</i>")
+                send_telegram_message(_format_tg(OK_TEMPLATE, fname), flush=True)
             else:
-                send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{resp_obj.get('err_msg', resp_obj)}</i>")
+                _notify_err(resp_obj.get("err_msg", resp_obj), flush=True)
         except Exception:
             logging.info(proc_response.text)
-            send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{proc_response.text}</i>")
+            _notify_err(proc_response.text, flush=True)
         print(proc_response.text)
     except Exception as e:
-        logging.error(f"Ошибка при обработке файла: {e}")
-        send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{e}</i>")
+        logging.error("Ошибка при обработке файла: %s", e)
+        _notify_err(e, flush=True)
 
 
 
 def main():
+    global TELEGRAM_ENABLED
+    import argparse
+
     # Настройка парсера аргументов
     parser = argparse.ArgumentParser(
         description='Загрузка подтверждения заказа',
@@ -192,25 +518,41 @@ def main():
         nargs='?',
         help='Путь к файлу подтверждения заказа (.xls)'
     )
+    parser.add_argument(
+        '--no-telegram',
+        action='store_true',
+        help='Не отправлять уведомления в Telegram'
+    )
     
     args = parser.parse_args()
+    if args.no_telegram:
+        TELEGRAM_ENABLED = False
     
     config = get_config()
     if not config:
         return
     
+    # BASE_URL из .env имеет приоритет, иначе используется base_url из config
+    if not BASE_URL:
+        if not config.get("base_url"):
+            error_msg = "Не указан BASE_URL ни в .env, ни в config.json"
+            logging.error(error_msg)
+            _notify_err(error_msg)
+            return
+        _set_base_url(config["base_url"])
+    
     # Гибридный подход: аргумент командной строки или config
     if args.file_path:
         file_path = args.file_path
-        logging.info(f"Используется файл из аргумента командной строки: {file_path}")
+        logging.info("Используется файл из аргумента командной строки: %s", file_path)
     else:
         if "confirmation_file_path" not in config:
             error_msg = "Не указан путь к файлу подтверждения ни в аргументах командной строки, ни в config.json"
             logging.error(error_msg)
-            send_telegram_message(f"❌ Ошибка подтверждения\n📎<b>Ошибка:</b><i>{error_msg}</i>")
+            _notify_err(error_msg)
             return
         file_path = config["confirmation_file_path"]
-        logging.info(f"Используется файл из конфига: {file_path}")
+        logging.info("Используется файл из конфига: %s", file_path)
     
     session = init_session(config)
     if not session: